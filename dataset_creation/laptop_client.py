@@ -5,13 +5,69 @@ Run this on your laptop to view the stream and capture images
 """
 
 import cv2
+import numpy as np
 import socket
 import struct
 import pickle
+import queue
 import threading
-import time
 import os
-from datetime import datetime
+import sys
+import time
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+try:
+    import torch
+    import torchvision
+    from torchvision.io import ImageReadMode
+except ImportError:
+    torch = None
+
+# Kernel socket buffer size for the stream and save connections
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# JPEG start-of-image marker, used to tell raw JPEG frames from pickled ones
+JPEG_SOI = b"\xff\xd8"
+
+# Ask the kernel to fill the whole buffer per recv; Windows does not
+# implement MSG_WAITALL the same way, so it keeps the plain read loop
+RECV_FLAGS = socket.MSG_WAITALL if sys.platform != "win32" else 0
+
+# Number of threads decoding received frames in parallel
+DECODE_WORKERS = 2
+
+# Set to a CPU index to pin the receive thread there with real-time priority
+# (Linux only, opt-in)
+RECV_CPU_ENV = "GO2_RECV_CPU"
+
+# Set to a busy-poll budget in microseconds to spin on the NIC queue instead
+# of waiting for interrupts (Linux only, opt-in)
+BUSY_POLL_ENV = "GO2_BUSY_POLL_US"
+
+# Linux socket options not exported by the socket module
+SO_BUSY_POLL = getattr(socket, "SO_BUSY_POLL", 46)
+SO_PREFER_BUSY_POLL = getattr(socket, "SO_PREFER_BUSY_POLL", 69)
+
+# Number of consecutive frames captured by a burst save
+BURST_SIZE = 5
+
+# Title of the stream display window
+WINDOW_NAME = 'GO2 Camera Stream - Ball Detection Dataset'
+
+# Frames wider than this are downscaled for display only
+DISPLAY_MAX_WIDTH = 1280
+
+# JPEG quality for locally saved images
+JPEG_QUALITY = 95
+
+# OpenCV builds without libjpeg-turbo swap BGR->RGB per pixel before encoding
+if simplejpeg is None and "libjpeg-turbo" not in cv2.getBuildInformation():
+    print("Warning: OpenCV was built without libjpeg-turbo; "
+          "install simplejpeg for faster local saves")
 
 class CameraClient:
     def __init__(self, go2_ip, stream_port=8888, save_port=8889):
@@ -20,20 +76,85 @@ class CameraClient:
         self.save_port = save_port
         self.stream_socket = None
         self.save_socket = None
+        self._size_data = bytearray(4)
+        self._size_view = memoryview(self._size_data)
         self.running = False
-        self.current_frame = None
+        # Two-slot frame buffer: the receiver fills the slot not being
+        # shown and flips _latest, so a published frame is never written to
+        self._frames = [None, None]
+        self._latest = 0
+        self._frame_seq = 0
         self.frame_lock = threading.Lock()
+        self._first_frame = threading.Event()
+        # Decode output buffers owned by the pipeline. A frame returns here only
+        # once it has left both slots and neither the display loop nor a local
+        # save is copying it (the leases below)
+        self._frame_pool = []
+        self._display_lease = None
+        self._save_lease = None
         self.image_counter = 0
+        # The counter is also advanced by the save worker for burst images
+        self._counter_lock = threading.Lock()
+        # Formatted date/time prefix of the last timestamp, cached per second
+        self._ts_second = None
+        self._ts_prefix = ""
+        
+        # Pick the JPEG decoder once so the decode workers never branch on it.
+        # Frames are only pooled for decoders that can write into them;
+        # cv2.imdecode cannot decode into an existing array
+        if simplejpeg is not None:
+            self._cpu_decode = self._decode_simplejpeg
+            cpu_reuse = True
+        else:
+            self._cpu_decode = self._decode_cv2
+            cpu_reuse = False
+        if torch is not None and torch.cuda.is_available():
+            self._decode = self._decode_gpu
+            self._reuse_frames = True
+        else:
+            self._decode = self._cpu_decode
+            self._reuse_frames = cpu_reuse
+        
+        # Raw frames waiting to be decoded, tagged with their arrival order
+        self._jpeg_q = queue.Queue(maxsize=2)
+        
+        # Frames still to capture for an armed burst save; the receiver queues
+        # each one raw and the save worker names and counts it when written
+        self._burst_remaining = 0
+        
+        # Pre-rendered overlay text, keyed by overlay name
+        self._overlays = {}
+        
+        # Local saves are encoded and written by a background thread
+        self._save_q = queue.Queue(maxsize=32)
+        save_thread = threading.Thread(target=self._save_worker)
+        save_thread.daemon = True
+        save_thread.start()
         
         # Create local save directory
         self.local_save_dir = "ball_dataset_local"
         if not os.path.exists(self.local_save_dir):
             os.makedirs(self.local_save_dir)
     
+    def _configure_socket(self, sock):
+        """Disable Nagle's algorithm and enlarge kernel buffers"""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        
+        busy_poll_us = os.environ.get(BUSY_POLL_ENV)
+        if busy_poll_us and sys.platform.startswith("linux"):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, int(busy_poll_us))
+                sock.setsockopt(socket.SOL_SOCKET, SO_PREFER_BUSY_POLL, 1)
+            except (OSError, ValueError) as e:
+                print(f"Could not enable busy polling: {e}")
+    
     def connect_to_stream(self):
         """Connect to the video stream"""
         try:
             self.stream_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._configure_socket(self.stream_socket)
             self.stream_socket.connect((self.go2_ip, self.stream_port))
             print(f"Connected to stream at {self.go2_ip}:{self.stream_port}")
             return True
@@ -45,6 +166,7 @@ class CameraClient:
         """Connect to the save command server"""
         try:
             self.save_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._configure_socket(self.save_socket)
             self.save_socket.connect((self.go2_ip, self.save_port))
             print(f"Connected to save server at {self.go2_ip}:{self.save_port}")
             return True
@@ -52,40 +174,197 @@ class CameraClient:
             print(f"Failed to connect to save server: {e}")
             return False
     
+    def _recv_exact(self, view):
+        """Fill a writable buffer completely from the stream socket"""
+        recv_into = self.stream_socket.recv_into
+        size = len(view)
+        received = recv_into(view, size, RECV_FLAGS)
+        
+        # Short reads only happen on EOF or when a signal interrupts the wait
+        while received < size:
+            if not received:
+                raise ConnectionError("Connection lost")
+            n = recv_into(view[received:], size - received, RECV_FLAGS)
+            if not n:
+                raise ConnectionError("Connection lost")
+            received += n
+    
+    def _recv_frame(self):
+        """Read one length-prefixed frame from the stream socket"""
+        # Frame size (4 bytes) goes into a buffer reused across frames
+        self._recv_exact(self._size_view)
+        frame_size = struct.unpack("!L", self._size_data)[0]
+        
+        # Frame data goes into a single preallocated buffer
+        frame_data = bytearray(frame_size)
+        self._recv_exact(memoryview(frame_data))
+        return frame_data
+    
+    def _unpack_frame(self, frame_data):
+        """Return the JPEG bytes of a received frame as a uint8 array"""
+        # Raw JPEG frames are used in place; older servers still send
+        # a pickled numpy array
+        if frame_data[:2] == JPEG_SOI:
+            return np.frombuffer(frame_data, dtype=np.uint8)
+        return pickle.loads(frame_data)
+    
+    def _decode_cv2(self, frame_encoded, out=None):
+        """Decode a JPEG buffer to a BGR image with OpenCV"""
+        return cv2.imdecode(frame_encoded, cv2.IMREAD_COLOR)
+    
+    def _decode_simplejpeg(self, frame_encoded, out=None):
+        """Decode a JPEG buffer to a BGR image with simplejpeg, reusing out when it fits"""
+        try:
+            if out is not None:
+                try:
+                    image = simplejpeg.decode_jpeg(frame_encoded, colorspace='BGR',
+                                                   fastdct=True, fastupsample=True,
+                                                   buffer=out)
+                    return out if image.shape == out.shape else image
+                except (TypeError, ValueError):
+                    # Older simplejpeg without buffer=, or the frame grew
+                    pass
+            return simplejpeg.decode_jpeg(frame_encoded, colorspace='BGR',
+                                          fastdct=True, fastupsample=True)
+        except ValueError:
+            return self._decode_cv2(frame_encoded)
+    
+    def _decode_gpu(self, frame_encoded, out=None):
+        """Decode a JPEG buffer to a BGR image with nvJPEG, reusing out when it fits"""
+        try:
+            data = torch.from_numpy(frame_encoded)
+            image = torchvision.io.decode_jpeg(data, mode=ImageReadMode.RGB, device='cuda')
+            # CHW RGB on the GPU -> HWC BGR numpy array for OpenCV
+            image = image.flip(0).permute(1, 2, 0)
+            # Copy into an array we own (not a tensor-backed view) so it can
+            # be pooled and reused for later frames
+            if out is None or out.shape != tuple(image.shape):
+                out = np.empty(tuple(image.shape), np.uint8)
+            torch.from_numpy(out).copy_(image)
+            return out
+        except RuntimeError:
+            return self._cpu_decode(frame_encoded, out)
+    
+    def _tune_receive_thread(self):
+        """Pin the calling thread to a single core and raise its priority"""
+        cpu = os.environ.get(RECV_CPU_ENV)
+        if not cpu or not hasattr(os, "sched_setaffinity"):
+            return
+        
+        # On Linux, pid 0 applies to the calling thread only
+        try:
+            os.sched_setaffinity(0, {int(cpu)})
+            print(f"Receive thread pinned to CPU {cpu}")
+        except (OSError, ValueError) as e:
+            print(f"Could not pin receive thread to CPU {cpu}: {e}")
+            return
+        
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(1))
+        except OSError:
+            try:
+                os.nice(-5)
+            except OSError as e:
+                print(f"Could not raise receive thread priority: {e}")
+    
     def receive_frames(self):
-        """Receive and decode video frames"""
+        """Receive video frames and hand them to the decode workers"""
+        self._tune_receive_thread()
         try:
+            seq = 0
             while self.running:
-                # Receive frame size (4 bytes)
-                size_data = b""
-                while len(size_data) < 4:
-                    chunk = self.stream_socket.recv(4 - len(size_data))
-                    if not chunk:
-                        raise ConnectionError("Connection lost")
-                    size_data += chunk
+                frame_data = self._recv_frame()
                 
-                frame_size = struct.unpack("!L", size_data)[0]
+                if self._burst_remaining > 0:
+                    try:
+                        self._save_q.put_nowait((None, frame_data))
+                    except queue.Full:
+                        print("✗ Save queue is full, burst image not saved")
+                    self._burst_remaining -= 1
                 
-                # Receive frame data
-                frame_data = b""
-                while len(frame_data) < frame_size:
-                    chunk = self.stream_socket.recv(min(4096, frame_size - len(frame_data)))
-                    if not chunk:
-                        raise ConnectionError("Connection lost")
-                    frame_data += chunk
-                
-                # Deserialize and decode frame
-                frame_encoded = pickle.loads(frame_data)
-                frame = cv2.imdecode(frame_encoded, cv2.IMREAD_COLOR)
-                
-                # Update current frame thread-safely
-                with self.frame_lock:
-                    self.current_frame = frame
+                # Keep only the freshest frames: drop the oldest if decoders lag
+                seq += 1
+                try:
+                    self._jpeg_q.put_nowait((seq, frame_data))
+                except queue.Full:
+                    try:
+                        self._jpeg_q.get_nowait()
+                    except queue.Empty:
+                        pass
+                    self._jpeg_q.put_nowait((seq, frame_data))
                 
         except Exception as e:
             if self.running:
                 print(f"Frame receiving error: {e}")
     
+    def decode_frames(self):
+        """Decode queued frames and publish them"""
+        while self.running:
+            try:
+                seq, frame_data = self._jpeg_q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            
+            try:
+                out = self._frame_pool.pop()
+            except IndexError:
+                out = None
+            
+            try:
+                frame = self._decode(self._unpack_frame(frame_data), out)
+            except Exception as e:
+                print(f"Frame decoding error: {e}")
+                # Hand the unused output buffer back so bad frames don't drain the pool
+                if out is not None:
+                    self._frame_pool.append(out)
+                continue
+            
+            # Publish into the back slot and swap, skipping frames that
+            # another worker has already overtaken
+            with self.frame_lock:
+                if seq > self._frame_seq:
+                    released = self._frames[1 - self._latest]
+                    self._frames[1 - self._latest] = frame
+                    self._latest ^= 1
+                    self._frame_seq = seq
+                    if not self._first_frame.is_set():
+                        self._first_frame.set()
+                else:
+                    released = frame
+                
+                # The displaced frame is out of both slots; recycle it unless
+                # the display loop or a local save is still copying it
+                if (self._reuse_frames and released is not None
+                        and released.base is None
+                        and released is not self._display_lease
+                        and released is not self._save_lease
+                        and len(self._frame_pool) < 2):
+                    self._frame_pool.append(released)
+    
+    @property
+    def current_frame(self):
+        """Most recently decoded frame (published frames are never modified)"""
+        return self._frames[self._latest]
+    
+    def _count_image(self):
+        """Add one image to the dataset count"""
+        with self._counter_lock:
+            self.image_counter += 1
+    
+    def _next_filename(self):
+        """Count a new image and return its dataset filename"""
+        with self._counter_lock:
+            self.image_counter += 1
+            return f"ball_dataset_{self.image_counter:04d}_{self._timestamp()}.jpg"
+    
+    def _timestamp(self):
+        """Current local time as YYYYmmdd_HHMMSS_mmm for image filenames"""
+        seconds, millis = divmod(time.time_ns() // 1_000_000, 1000)
+        if seconds != self._ts_second:
+            self._ts_second = seconds
+            self._ts_prefix = time.strftime("%Y%m%d_%H%M%S", time.localtime(seconds))
+        return f"{self._ts_prefix}_{millis:03d}"
+    
     def save_image_remote(self, filename=None):
         """Send command to save image on GO2"""
         try:
@@ -94,7 +373,8 @@ class CameraClient:
             else:
                 command = "SAVE"
             
-            self.save_socket.send(command.encode('utf-8'))
+            # Commands are unframed text, so make sure the whole command goes out
+            self.save_socket.sendall(command.encode('utf-8'))
             response = self.save_socket.recv(1024).decode('utf-8')
             
             if response.startswith("SAVED:"):
@@ -109,35 +389,104 @@ class CameraClient:
             print(f"Error saving remote image: {e}")
             return False
     
+    def _write_jpeg(self, filepath, frame):
+        """Encode a BGR frame as JPEG and write it to disk"""
+        if simplejpeg is not None:
+            # libjpeg-turbo encodes BGR directly, without a colour swap pass
+            data = simplejpeg.encode_jpeg(frame, quality=JPEG_QUALITY, colorspace='BGR')
+            with open(filepath, 'wb') as f:
+                f.write(data)
+            return True
+        return cv2.imwrite(filepath, frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    
+    def _save_worker(self):
+        """Write queued local saves to disk"""
+        while True:
+            filepath, frame = self._save_q.get()
+            try:
+                if isinstance(frame, bytearray):
+                    # Burst frames are the stream's JPEG bytes, written
+                    # unchanged instead of being decoded and re-encoded
+                    filepath = os.path.join(self.local_save_dir, self._next_filename())
+                    with open(filepath, 'wb') as f:
+                        f.write(self._unpack_frame(frame))
+                    success = True
+                else:
+                    success = self._write_jpeg(filepath, frame)
+                
+                if success:
+                    print(f"✓ Image saved locally: {filepath}")
+                else:
+                    print(f"✗ Failed to save image: {filepath}")
+            except Exception as e:
+                print(f"Error saving local image: {e}")
+            finally:
+                self._save_q.task_done()
+    
     def save_image_local(self, filename=None):
         """Save current frame locally on laptop"""
         try:
+            # Lease the frame so decoders do not recycle it while it is copied;
+            # the queued save needs its own copy once the frame is replaced
             with self.frame_lock:
-                if self.current_frame is None:
-                    print("✗ No frame available to save")
-                    return False
-                
-                frame = self.current_frame.copy()
+                frame = self.current_frame
+                self._save_lease = frame
+            try:
+                if frame is not None:
+                    frame = frame.copy()
+            finally:
+                self._save_lease = None
+            
+            if frame is None:
+                print("✗ No frame available to save")
+                return False
             
             if filename is None:
-                self.image_counter += 1
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-                filename = f"ball_dataset_{self.image_counter:04d}_{timestamp}.jpg"
+                filename = self._next_filename()
             
             filepath = os.path.join(self.local_save_dir, filename)
-            success = cv2.imwrite(filepath, frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            
-            if success:
-                print(f"✓ Image saved locally: {filepath}")
-                return True
-            else:
-                print(f"✗ Failed to save image: {filepath}")
-                return False
+            self._save_q.put_nowait((filepath, frame))
+            return True
             
+        except queue.Full:
+            print("✗ Save queue is full, image not saved")
+            return False
         except Exception as e:
             print(f"Error saving local image: {e}")
             return False
     
+    def save_burst(self, n=BURST_SIZE):
+        """Arm a local save of the next n received frames"""
+        if self._burst_remaining > 0:
+            print("✗ A burst is already in progress")
+            return False
+        
+        self._burst_remaining = n
+        print(f"Capturing burst of {n} images...")
+        return True
+    
+    def _draw_overlay(self, frame, name, text, y, scale, color, thickness=2):
+        """Draw cached text onto a frame, re-rendering only when it changes"""
+        height, width = frame.shape[:2]
+        key = (text, width, height, y)
+        cached = self._overlays.get(name)
+        
+        if cached is None or cached[0] != key:
+            # Render the text once into a full-width band and keep its mask
+            (_, text_height), baseline = cv2.getTextSize(
+                text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+            top = max(y - text_height - thickness, 0)
+            bottom = min(y + baseline + thickness, height)
+            band = np.zeros((bottom - top, width, 3), np.uint8)
+            cv2.putText(band, text, (10, y - top), cv2.FONT_HERSHEY_SIMPLEX,
+                        scale, color, thickness)
+            mask = band.any(axis=2, keepdims=True)
+            cached = (key, top, band, mask)
+            self._overlays[name] = cached
+        
+        _, top, band, mask = cached
+        np.copyto(frame[top:top + band.shape[0]], band, where=mask)
+    
     def display_instructions(self):
         """Display control instructions"""
         instructions = """
@@ -146,6 +495,7 @@ Controls:
 - 's' or SPACE: Save image on GO2 (remote)
 - 'l': Save image locally on laptop
 - 'b': Save image both remote and local
+- 'r': Save a burst of consecutive frames locally
 - 'q' or ESC: Quit
 - 'h': Show this help again
 
@@ -171,28 +521,63 @@ and angles to create a diverse dataset!
             receive_thread.daemon = True
             receive_thread.start()
             
+            # Start frame decoding threads
+            for _ in range(DECODE_WORKERS):
+                decode_thread = threading.Thread(target=self.decode_frames)
+                decode_thread.daemon = True
+                decode_thread.start()
+            
             # Wait for first frame
             print("Waiting for video stream...")
-            while self.current_frame is None and self.running:
-                time.sleep(0.1)
+            while self.running and not self._first_frame.wait(timeout=10):
+                print("Still waiting for video stream...")
             
             self.display_instructions()
             
+            # Prefer an OpenGL window so imshow uploads frames as a texture;
+            # OpenCV builds without OpenGL fall back to the default window
+            try:
+                cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_OPENGL | cv2.WINDOW_AUTOSIZE)
+            except cv2.error:
+                pass
+            
             # Main display loop
+            shown = None
             while self.running:
+                display_frame = None
+                
+                # Hold the lock only long enough to grab the latest frame, and
+                # lease it so decoders do not recycle it while it is copied
                 with self.frame_lock:
-                    if self.current_frame is not None:
-                        # Add overlay information
-                        display_frame = self.current_frame.copy()
-                        
-                        # Add text overlay
-                        cv2.putText(display_frame, f"Images saved: {self.image_counter}", 
-                                  (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                        cv2.putText(display_frame, "Press 's' to save, 'q' to quit", 
-                                  (10, display_frame.shape[0] - 10), 
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                        
-                        cv2.imshow('GO2 Camera Stream - Ball Detection Dataset', display_frame)
+                    frame_ref = self.current_frame
+                    state = (self._frame_seq, self.image_counter)
+                    self._display_lease = frame_ref
+                
+                # Only redraw when a new frame arrived or the counter changed
+                if frame_ref is not None and state != shown:
+                    shown = state
+                    
+                    # Large frames are shown downscaled; saves keep full resolution.
+                    # Overlays go on the resized image or a copy so saved frames stay clean
+                    height, width = frame_ref.shape[:2]
+                    if width > DISPLAY_MAX_WIDTH:
+                        display_size = (DISPLAY_MAX_WIDTH, round(height * DISPLAY_MAX_WIDTH / width))
+                        display_frame = cv2.resize(frame_ref, display_size, interpolation=cv2.INTER_AREA)
+                    else:
+                        display_frame = frame_ref.copy()
+                
+                # Done reading the shared frame
+                self._display_lease = None
+                frame_ref = None
+                
+                if display_frame is not None:
+                    # Add text overlay
+                    self._draw_overlay(display_frame, "counter", f"Images saved: {self.image_counter}",
+                                       30, 0.7, (0, 255, 0))
+                    self._draw_overlay(display_frame, "help", "Press 's' to save, 'q' to quit",
+                                       display_frame.shape[0] - 10, 0.6, (255, 255, 255))
+                    
+                    cv2.imshow(WINDOW_NAME, display_frame)
                 
                 # Handle keyboard input
                 key = cv2.waitKey(1) & 0xFF
@@ -201,20 +586,20 @@ and angles to create a diverse dataset!
                     break
                 elif key == ord('s') or key == ord(' '):  # 's' or SPACE - save remote
                     if self.save_image_remote():
-                        self.image_counter += 1
+                        self._count_image()
                 elif key == ord('l'):  # 'l' - save local
                     if self.save_image_local():
                         print(f"📁 Total images in dataset: {self.image_counter}")
                 elif key == ord('b'):  # 'b' - save both
-                    self.image_counter += 1
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-                    filename = f"ball_dataset_{self.image_counter:04d}_{timestamp}.jpg"
+                    filename = self._next_filename()
                     
                     remote_success = self.save_image_remote(filename)
                     local_success = self.save_image_local(filename)
                     
                     if remote_success or local_success:
-                        self.image_counter += 1
+                        self._count_image()
+                elif key == ord('r'):  # 'r' - burst save local
+                    self.save_burst()
                 elif key == ord('h'):  # 'h' - help
                     self.display_instructions()
         
@@ -231,6 +616,9 @@ and angles to create a diverse dataset!
         
         cv2.destroyAllWindows()
         
+        # Let queued local saves finish before exiting
+        self._save_q.join()
+        
         if self.stream_socket:
             self.stream_socket.close()
         